@@ -1,5 +1,39 @@
-from visualkeras.layered import layered_view
+from types import SimpleNamespace
+import pytest
+from visualkeras.layered import layered_view, _get_output_shape_txt, _get_box_groups
+from visualkeras.layer_utils import SpacingDummyLayer
 
 
 def test_graph_view(model):
-    layered_view(model)
\ No newline at end of file
+    layered_view(model)
+
+
+def test_get_output_shape_txt():
+    assert _get_output_shape_txt(SimpleNamespace(output_shape=(None, 32, 32, 3))) == "32x32\n3"
+    assert _get_output_shape_txt(SimpleNamespace(output_shape=[(None, 8, 4)])) == "8\n4"
+    assert _get_output_shape_txt(SimpleNamespace(output_shape=(None, 10))) == "10"
+
+
+class _Conv:
+    pass
+
+
+class _Dropout:
+    pass
+
+
+def test_get_box_groups():
+    layers = [_Conv(), _Conv(), SpacingDummyLayer(), _Conv(), _Dropout(), _Conv(), _Conv(), _Conv()]
+    # the final group is closed by the last layer of the model
+    assert _get_box_groups(layers, [_Dropout], []) == [(0, 1, 2), (2, 2, 4), (3, 5, 7)]
+
+    # a trailing spacing or ignored layer closes the final group without opening an empty one
+    layers = [_Conv(), SpacingDummyLayer(), _Conv(), _Conv(), SpacingDummyLayer()]
+    assert _get_box_groups(layers, [], []) == [(0, 0, 1), (1, 2, 4)]
+    assert _get_box_groups(layers[:4], [], [3]) == [(0, 0, 1), (1, 1, 3)]
+
+    with pytest.raises(RuntimeError):
+        _get_box_groups([_Conv(), SpacingDummyLayer(), SpacingDummyLayer(), _Conv()], [], [])
+
+    with pytest.raises(RuntimeError):
+        _get_box_groups([SpacingDummyLayer(), _Conv()], [], [])
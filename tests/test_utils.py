@@ -1,5 +1,7 @@
 import unittest
-from visualkeras.utils import get_rgba_tuple, self_multiply, get_keys_by_value, fade_color
+from PIL import Image
+from visualkeras.utils import get_rgba_tuple, self_multiply, get_keys_by_value, fade_color, get_pen, get_brush, \
+    BoxArray, acquire_image, release_image
 
 
 class UtilMethods(unittest.TestCase):
@@ -67,6 +69,15 @@ class UtilMethods(unittest.TestCase):
         y = (100, 50, 0, 44)
         self.assertEqual(x, y)
 
+    def test_get_rgba_tuples_by_list(self):
+        x = get_rgba_tuple([100, 50, 0])
+        y = (100, 50, 0, 255)
+        self.assertEqual(x, y)
+
+    def test_get_rgba_tuples_keeps_value_types(self):
+        self.assertEqual(get_rgba_tuple((1.0, 2.0, 3.0)), (1.0, 2.0, 3.0, 255))
+        self.assertIsInstance(get_rgba_tuple((1, 2, 3))[0], int)
+
     def test_get_rgba_tuples_by_int(self):
         x = get_rgba_tuple(0x010203)
         y = (1, 2, 3, 0)
@@ -79,6 +90,50 @@ class UtilMethods(unittest.TestCase):
     def test_fade_color(self):
         self.assertEqual(fade_color((0, 10, 30, 200), 20), (0, 0, 10, 200))
 
+    def test_get_pen_is_cached(self):
+        self.assertIs(get_pen((1, 2, 3, 255)), get_pen((1, 2, 3, 255)))
+        self.assertIsNot(get_pen((1, 2, 3, 255)), get_pen((3, 2, 1, 255)))
+
+    def test_get_brush_is_cached(self):
+        self.assertIs(get_brush((1, 2, 3, 255)), get_brush((1, 2, 3, 255)))
+        self.assertIsNot(get_brush((1, 2, 3, 255)), get_brush((3, 2, 1, 255)))
+
+    def test_box_array(self):
+        boxes = BoxArray([0, 10], [5, 15], [1, 2], [6, 7], [3, 0], ['red', 'blue'], ['black', 'black'], 10)
+        self.assertEqual(len(boxes), 2)
+
+        boxes.x1 += 1
+        box = boxes[1]
+        self.assertEqual((box.x1, box.x2, box.y1, box.y2, box.de), (11, 15, 2, 7, 0))
+        self.assertEqual(box.fill, (0, 0, 255, 255))
+        self.assertEqual(box.shade, 10)
+
+    def test_acquire_released_image(self):
+        img = acquire_image((4, 3), 'red')
+        self.assertEqual(img.size, (4, 3))
+        self.assertEqual(img.getpixel((0, 0)), (255, 0, 0, 255))
+
+        release_image(img)
+        reused = acquire_image((4, 3), 'blue')
+        self.assertIs(reused, img)
+        self.assertEqual(reused.getpixel((3, 2)), (0, 0, 255, 255))
+
+        self.assertIsNot(acquire_image((4, 3)), img)
+
+    def test_acquire_image_clears_like_new_image(self):
+        img = acquire_image((2, 2), 0x11223344)
+        release_image(img)
+        reused = acquire_image((2, 2), 0x11223344)
+        self.assertIs(reused, img)
+        self.assertEqual(reused.getpixel((0, 0)), Image.new('RGBA', (1, 1), 0x11223344).getpixel((0, 0)))
+
+    def test_release_image_pool_is_bounded(self):
+        images = [acquire_image((i + 1, 1)) for i in range(20)]
+        for img in images:
+            release_image(img)
+        self.assertIsNot(acquire_image((1, 1)), images[0])
+        self.assertIs(acquire_image((20, 1)), images[-1])
+
 
 if __name__ == '__main__':
     unittest.main()
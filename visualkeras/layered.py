@@ -1,10 +1,100 @@
 import aggdraw
 from PIL import ImageFont
 from math import ceil
+import numpy as np
 from .utils import *
 from .layer_utils import *
 
 
+def _get_output_shape_txt(layer) -> str:
+    """
+    Formats the output shape of a layer as label, e.g. "32x32\\n3". The batch dimension is dropped.
+
+    :param layer: A keras layer.
+    :return: Output shape label.
+    """
+    output_shape = [x for x in list(layer.output_shape) if x is not None]
+    if isinstance(output_shape[0], tuple):
+        output_shape = list(output_shape[0])
+        output_shape = [x for x in output_shape if x is not None]
+    parts = list(map(str, output_shape))
+    if len(parts) < 2:
+        return "".join(parts)
+    return "x".join(parts[:-1]) + "\n" + parts[-1]
+
+
+def _get_box_groups(layers: list, type_ignore: list, index_ignore: list) -> list:
+    """
+    Splits the drawn boxes into groups separated by ignored or spacing layers. The label of a group is taken from the
+    layer closing it, which is the last layer of the model for the final group. A trailing ignored or spacing layer
+    does not open an empty group.
+
+    :param layers: Layers of the keras model.
+    :param type_ignore: List of layer types in the keras model to ignore during drawing.
+    :param index_ignore: List of layer indexes in the keras model to ignore during drawing.
+    :return: List of (first box index, last box index, index of the layer closing the group) tuples.
+    """
+    box_groups = list()
+    group_start = 0
+    num_boxes = 0
+
+    for index, layer in enumerate(layers):
+        if type(layer) in type_ignore or index in index_ignore or type(layer) == SpacingDummyLayer:
+            if num_boxes == group_start:
+                raise RuntimeError(
+                    f"Unexpected spacing layer at index {index}. Two spacing layers in a row not allowed.")
+            box_groups.append((group_start, num_boxes - 1, index))
+            group_start = num_boxes
+        else:
+            num_boxes += 1
+
+    if group_start < num_boxes:
+        box_groups.append((group_start, num_boxes - 1, len(layers) - 1))
+
+    return box_groups
+
+
+def _get_box_geometry(layer_dims: np.ndarray, z_steps: np.ndarray, box_step_index: list, start: float, spacing: int,
+                      draw_volume: bool, scale_xy: float, scale_z: float, min_xy: int, min_z: int, max_xy: int,
+                      max_z: int) -> tuple:
+    """
+    Computes the (uncentered) coordinates of all boxes of a layered view at once.
+
+    :param layer_dims: Array of shape (N, 3) with the raw x, y and z extent of each drawn layer. 0 falls back to the
+    minimum size.
+    :param z_steps: Pointer increments in model order. Entries at box_step_index are overwritten by the box sizes.
+    :param box_step_index: Position of each drawn layer in z_steps.
+    :param start: Initial position of the pointer.
+    :param spacing: Spacing in pixel between two layers.
+    :param draw_volume: Flag to switch between 3D volumetric view and 2D box view.
+    :param scale_xy: Scalar multiplier for the x and y size of each layer.
+    :param scale_z: Scalar multiplier for the z size of each layer.
+    :param min_xy: Minimum x and y size in pixel a layer will have.
+    :param min_z: Minimum z size in pixel a layer will have.
+    :param max_xy: Maximum x and y size in pixel a layer will have.
+    :param max_z: Maximum z size in pixel a layer will have.
+    :return: Arrays x1, x2, y1, y2, de.
+    """
+    x = np.clip(layer_dims[:, 0] * scale_xy, min_xy, max_xy)
+    y = np.clip(layer_dims[:, 1] * scale_xy, min_xy, max_xy)
+    z = np.clip(layer_dims[:, 2] * scale_z, min_z, max_z)
+
+    de = x / 3 if draw_volume else np.zeros_like(x)
+
+    z_steps[box_step_index] = z + spacing
+    current_z = np.cumsum(np.concatenate(([start], z_steps)))[box_step_index]
+
+    # top left coordinate
+    x1 = current_z - de / 2
+    y1 = de
+
+    # bottom right coordinate
+    x2 = x1 + z
+    y2 = y1 + y
+
+    return x1, x2, y1, y2, de
+
+
 def layered_view(model, to_file: str = None, min_z: int = 20, min_xy: int = 20, max_z: int = 400,
                  max_xy: int = 2000,
                  scale_z: float = 0.1, scale_xy: float = 4, type_ignore: list = None, index_ignore: list = None,
@@ -52,16 +142,21 @@ def layered_view(model, to_file: str = None, min_z: int = 20, min_xy: int = 20,
 
     # Iterate over the model to compute bounds and generate boxes
 
-    boxes = list()
-    layer_y = list()
     color_wheel = ColorWheel()
-    current_z = padding + padding_left
     x_off = -1
 
     layer_types = list()
-
-    img_height = 0
-    max_right = 0
+    layer_types_seen = set()
+
+    # Raw (x, y, z) extents of every drawn layer, 0 marks an axis that falls back to the minimum size
+    layer_dims = list()
+    layer_fills = list()
+    layer_outlines = list()
+    # Pointer increments in model order and the position of each drawn layer in there
+    z_steps = list()
+    box_step_index = list()
+    # Position of each drawn layer in model.layers
+    box_layer_index = list()
 
     if type_ignore is None:
         type_ignore = list()
@@ -72,27 +167,26 @@ def layered_view(model, to_file: str = None, min_z: int = 20, min_xy: int = 20,
     if color_map is None:
         color_map = dict()
 
+    # Output shape labels by index in model.layers, only for layers that get a label
+    layer_shape_txt = dict()
+
     for index, layer in enumerate(model.layers):
 
         # Ignore layers that the use has opted out to
-        if type(layer) in type_ignore or index in index_ignore:
-            continue
+        is_ignored = type(layer) in type_ignore or index in index_ignore
 
-        # Do no render the SpacingDummyLayer, just increase the pointer
-        if type(layer) == SpacingDummyLayer:
-            print(f"Spacing layer!")
-            current_z += layer.spacing
+        if is_ignored or type(layer) == SpacingDummyLayer:
+            # Do no render the SpacingDummyLayer, just increase the pointer
+            if not is_ignored:
+                z_steps.append(layer.spacing)
             continue
 
         layer_type = type(layer)
 
-        if layer_type not in layer_types:
+        if layer_type not in layer_types_seen:
+            layer_types_seen.add(layer_type)
             layer_types.append(layer_type)
 
-        x = min_xy
-        y = min_xy
-        z = min_z
-
         if isinstance(layer.output_shape, tuple):
             shape = layer.output_shape
         elif isinstance(layer.output_shape, list) and len(
@@ -101,235 +195,128 @@ def layered_view(model, to_file: str = None, min_z: int = 20, min_xy: int = 20,
         else:
             raise RuntimeError(f"not supported tensor shape {layer.output_shape}")
 
-        if len(shape) >= 4:
-            x = min(max(shape[1] * scale_xy, x), max_xy)
-            y = min(max(shape[2] * scale_xy, y), max_xy)
-            z = min(max(self_multiply(shape[3:]) * scale_z, z), max_z)
+        if len(shape) == 4:
+            layer_dims.append((shape[1], shape[2], shape[3] or 0))
+        elif len(shape) > 4:
+            layer_dims.append((shape[1], shape[2], self_multiply(shape[3:])))
         elif len(shape) == 3:
-            x = min(max(shape[1] * scale_xy, x), max_xy)
-            y = min(max(shape[2] * scale_xy, y), max_xy)
-            z = min(max(z), max_z)
+            layer_dims.append((shape[1], shape[2], 0))
         elif len(shape) == 2:
             if one_dim_orientation == 'x':
-                x = min(max(shape[1] * scale_xy, x), max_xy)
+                layer_dims.append((shape[1], 0, 0))
             elif one_dim_orientation == 'y':
-                y = min(max(shape[1] * scale_xy, y), max_xy)
+                layer_dims.append((0, shape[1], 0))
             elif one_dim_orientation == 'z':
-                z = min(max(shape[1] * scale_z, z), max_z)
+                layer_dims.append((0, 0, shape[1]))
             else:
                 raise ValueError(f"unsupported orientation {one_dim_orientation}")
         else:
             raise RuntimeError(f"not supported tensor shape {layer.output_shape}")
 
-        box = Box()
-
-        box.de = 0
-        if draw_volume:
-            box.de = x / 3
+        fill = get_rgba_tuple(color_map.get(layer_type, {}).get('fill', color_wheel.get_color(layer_type)))
+        outline = get_rgba_tuple(color_map.get(layer_type, {}).get('outline', 'black'))
+        color_map[layer_type] = {'fill': fill, 'outline': outline}
+        layer_fills.append(fill)
+        layer_outlines.append(outline)
 
-        if x_off == -1:
-            x_off = box.de / 2
+        if draw_shapes == 1 or draw_shapes == 2:
+            layer_shape_txt[index] = _get_output_shape_txt(layer)
 
-        # top left coordinate
-        box.x1 = current_z - box.de / 2
-        box.y1 = box.de
+        box_step_index.append(len(z_steps))
+        box_layer_index.append(index)
+        z_steps.append(0)
 
-        # bottom right coordinate
-        box.x2 = box.x1 + z
-        box.y2 = box.y1 + y
+    x1, x2, y1, y2, de = _get_box_geometry(np.array(layer_dims, dtype=float).reshape(-1, 3),
+                                           np.array(z_steps, dtype=float), box_step_index,
+                                           padding + padding_left, spacing, draw_volume,
+                                           scale_xy, scale_z, min_xy, min_z, max_xy, max_z)
 
-        box.fill = color_map.get(layer_type, {}).get('fill', color_wheel.get_color(layer_type))
-        box.outline = color_map.get(layer_type, {}).get('outline', 'black')
-        color_map[layer_type] = {'fill': box.fill, 'outline': box.outline}
+    if len(de) > 0:
+        x_off = de[0] / 2
 
-        box.shade = shade_step
-        boxes.append(box)
-        layer_y.append(box.y2 - (box.y1 - box.de))
+    # Image bounds, each layer spans its height plus the depth of the volume
+    layer_y = y2 - (y1 - de)
 
-        # Update image bounds
-        hh = box.y2 - (box.y1 - box.de)
-        if hh > img_height:
-            img_height = hh
+    img_width = int(ceil((x2 + de).max(initial=0) + x_off + padding))
+    img_height = int(ceil(layer_y.max(initial=0) + padding_vertical))
 
-        if box.x2 + box.de > max_right:
-            max_right = box.x2 + box.de
-
-        current_z += z + spacing
+    # x, y correction (centering)
+    y_off = (img_height - layer_y) / 2
+    boxes = BoxArray(x1=x1 + x_off, x2=x2 + x_off, y1=y1 + y_off, y2=y2 + y_off, de=de,
+                     fill=layer_fills, outline=layer_outlines, shade=shade_step)
 
     # Generate image
-    img_width = max_right + x_off + padding
-    img_height += padding_vertical
-
-    img = Image.new('RGBA', (int(ceil(img_width)), int(ceil(img_height))), background_fill)
+    img = acquire_image((img_width, img_height), background_fill)
     draw = aggdraw.Draw(img)
 
-    # x, y correction (centering)
-    for i, node in enumerate(boxes):
-        y_off = (img.height - layer_y[i]) / 2
-        node.y1 += y_off
-        node.y2 += y_off
-
-        node.x1 += x_off
-        node.x2 += x_off
-
-    # Draw created boxes
-
-    last_box = None
+    # Draw created boxes, funnels are drawn straight from the coordinate arrays and Box objects are only created for
+    # drawing the boxes themselves
+    x1, x2, y1, y2, de = (v.tolist() for v in (boxes.x1, boxes.x2, boxes.y1, boxes.y2, boxes.de))
 
     if draw_reversed:
-        for box in boxes:
-            pen = aggdraw.Pen(get_rgba_tuple(box.outline))
-
-            if last_box is not None and draw_funnel:
-                # Top connection back
-                draw.line([last_box.x2 - last_box.de, last_box.y1 - last_box.de,
-                           box.x1 - box.de, box.y1 - box.de], pen)
-                # Bottom connection back
-                draw.line([last_box.x2 - last_box.de, last_box.y2 - last_box.de,
-                           box.x1 - box.de, box.y2 - box.de], pen)
-
-            last_box = box
-
-        last_box = None
-
-        for box in reversed(boxes):
-            pen = aggdraw.Pen(get_rgba_tuple(box.outline))
-
-            if last_box is not None and draw_funnel:
-                # Top connection front
-                draw.line([last_box.x1, last_box.y1,
-                           box.x2, box.y1], pen)
-
-                # Bottom connection front
-                draw.line([last_box.x1, last_box.y2,
-                           box.x2, box.y2], pen)
-
-            box.draw(draw, draw_reversed=True)
-
-            last_box = box
+        if draw_funnel:
+            for i in range(1, len(boxes)):
+                # Top and bottom connection back
+                path = aggdraw.Path()
+                path.moveto(x2[i - 1] - de[i - 1], y1[i - 1] - de[i - 1])
+                path.lineto(x1[i] - de[i], y1[i] - de[i])
+                path.moveto(x2[i - 1] - de[i - 1], y2[i - 1] - de[i - 1])
+                path.lineto(x1[i] - de[i], y2[i] - de[i])
+                draw.path(path, get_pen(boxes.outline[i]))
+
+        for i in reversed(range(len(boxes))):
+            if i < len(boxes) - 1 and draw_funnel:
+                # Top and bottom connection front
+                path = aggdraw.Path()
+                path.moveto(x1[i + 1], y1[i + 1])
+                path.lineto(x2[i], y1[i])
+                path.moveto(x1[i + 1], y2[i + 1])
+                path.lineto(x2[i], y2[i])
+                draw.path(path, get_pen(boxes.outline[i]))
+
+            boxes[i].draw(draw, draw_reversed=True)
     else:
-        for box in boxes:
-            pen = aggdraw.Pen(get_rgba_tuple(box.outline))
-
-            if last_box is not None and draw_funnel:
-                draw.line([last_box.x2 + last_box.de, last_box.y1 - last_box.de,
-                           box.x1 + box.de, box.y1 - box.de], pen)
-                draw.line([last_box.x2 + last_box.de, last_box.y2 - last_box.de,
-                           box.x1 + box.de, box.y2 - box.de], pen)
-
-                draw.line([last_box.x2, last_box.y2,
-                           box.x1, box.y2], pen)
-
-                draw.line([last_box.x2, last_box.y1,
-                           box.x1, box.y1], pen)
-
-            box.draw(draw, draw_reversed=False)
-
-            last_box = box
+        for i in range(len(boxes)):
+            if i > 0 and draw_funnel:
+                path = aggdraw.Path()
+                path.moveto(x2[i - 1] + de[i - 1], y1[i - 1] - de[i - 1])
+                path.lineto(x1[i] + de[i], y1[i] - de[i])
+                path.moveto(x2[i - 1] + de[i - 1], y2[i - 1] - de[i - 1])
+                path.lineto(x1[i] + de[i], y2[i] - de[i])
+                path.moveto(x2[i - 1], y2[i - 1])
+                path.lineto(x1[i], y2[i])
+                path.moveto(x2[i - 1], y1[i - 1])
+                path.lineto(x1[i], y1[i])
+                draw.path(path, get_pen(boxes.outline[i]))
+
+            boxes[i].draw(draw, draw_reversed=False)
 
     draw.flush()
 
+    if draw_shapes != 0:
+        # Label positions centered beneath every box
+        text_x = boxes.x1 + (boxes.x2 - boxes.x1) / 2
+        text_y = boxes.y2 + 20
+        draw_layer_shapes = ImageDraw.Draw(img)
+
     if draw_shapes == 3:
         # ----------------Draw text under boxes between spacing layers----------------
-        i = -1
-        draw_text = False
-        spacing_layer_index = -1
-        draw_layer_shapes = ImageDraw.Draw(img)
-        for index, layer in enumerate(model.layers):
-            # Count number of layers between two spacing layers
-            print(f"type layer: {type(layer)}")
-            if type(layer) in type_ignore or type(layer) == SpacingDummyLayer or index in index_ignore:
-                idx1 = spacing_layer_index
-                idx2 = i
-                if idx2 - idx1 <= 0:
-                    raise RuntimeError(
-                        f"Unexpected spacing layer at index {index}. Two spacing layers in a row not allowed.")
-                if (idx2 - idx1) % 2 == 1:  # Odd number of layers between two spacing layers
-                    print(f"Odd number of layers between two spacing layers")
-                    idx = idx1 + ceil((idx2 - idx1) / 2)
-                    box = boxes[idx]
-                    text_x = box.x1 + (box.x2 - box.x1) / 2
-                    text_y = box.y2 + 20
-                else:  # Even number of layers between two spacing layers
-                    print(f"Even number of layers between two spacing layers")
-                    idx = idx1 + (idx2 - idx1) // 2
-                    box = boxes[idx]
-                    text_x = box.x1 + (box.x2 - box.x1) / 2 + spacing
-                    text_y = box.y2 + 20
-
-                spacing_layer_index = i  # After i-th box comes spacing layer
-                draw_text = True
-            else:
-                i += 1
-
-            if index == len(model.layers) - 1:
-                idx1 = spacing_layer_index
-                idx2 = i
-                if idx2 - idx1 <= 0:
-                    raise RuntimeError(
-                        f"Unexpected spacing layer at index {index}. Two spacing layers in a row not allowed")
-                if idx2 - idx1 % 2 == 1:  # Odd number of layers between two spacing layers
-                    idx = idx1 + ceil((idx2 - idx1) / 2)
-                    box = boxes[i]
-                    text_x = box.x1 + (box.x2 - box.x1) / 2
-                    text_y = box.y2 + 20
-                else:  # Even number of layers between two spacing layers
-                    idx = idx1 + (idx2 - idx1) // 2
-                    box = boxes[i]
-                    text_x = box.x1 + (box.x2 - box.x1) / 2 + padding
-                    text_y = box.y2 + 20
-                draw_text = True
-
-            if draw_text:
-                # Draw text
-                print(f"Drawing text")
-                output_shape = [x for x in list(layer.output_shape) if x is not None]
-                if isinstance(output_shape[0], tuple):
-                    output_shape = list(output_shape[0])
-                    output_shape = [x for x in output_shape if x is not None]
-                output_shape_txt = ""
-                for ii in range(len(output_shape)):
-                    output_shape_txt += str(output_shape[ii])
-                    if ii < len(output_shape) - 2:
-                        output_shape_txt += "x"
-                    if ii == len(output_shape) - 2:
-                        output_shape_txt += "\n"
-                draw_layer_shapes.text((text_x, text_y), output_shape_txt, font=font_shapes, fill=font_color,
-                                       direction='ltr', anchor='mm', align='center')
-                draw_text = False
+        for first, last, index in _get_box_groups(model.layers, type_ignore, index_ignore):
+            # Center box of the group, or the left one of the two center boxes for an even number of boxes
+            i = (first + last) // 2
+            xy = (text_x[i] + spacing if (last - first) % 2 == 1 else text_x[i], text_y[i])
+            draw_layer_shapes.text(xy, _get_output_shape_txt(model.layers[index]), font=font_shapes, fill=font_color,
+                                   direction='ltr', anchor='mm', align='center')
 
     elif draw_shapes == 1 or draw_shapes == 2:
         # ----------------Draw text under every box----------------
-        i = -1
-        draw_text = False
-        draw_layer_shapes = ImageDraw.Draw(img)
-        for index, layer in enumerate(model.layers):
-            # Count number of layers between two spacing layers
-            if type(layer) in type_ignore or type(layer) == SpacingDummyLayer or index in index_ignore:
-                continue
-            i += 1
-            box = boxes[i]
-            text_x = box.x1 + (box.x2 - box.x1) / 2
-            text_y = box.y2 + 20
-            if draw_shapes == 2 and i % 2 == 1:
-                text_x = box.x1 - box.de + (box.x2 - box.x1) / 2
-                text_y = box.y1 - box.de - 20
-
-                # text_x = box.x1 - box.de + (box.x2-(box.x1-box.de))/2
-                # text_y = box.y1 - box.de + (box.y2-(box.y1-box.de))/2
-
-            output_shape = [x for x in list(layer.output_shape) if x is not None]
-            if isinstance(output_shape[0], tuple):
-                output_shape = list(output_shape[0])
-                output_shape = [x for x in output_shape if x is not None]
-            output_shape_txt = ""
-            for ii in range(len(output_shape)):
-                output_shape_txt += str(output_shape[ii])
-                if ii < len(output_shape) - 2:
-                    output_shape_txt += "x"
-                if ii == len(output_shape) - 2:
-                    output_shape_txt += "\n"
-            draw_layer_shapes.text((text_x, text_y), output_shape_txt, font=font_shapes, fill=font_color,
+        if draw_shapes == 2:
+            # Every second label goes above its box
+            text_x[1::2] = (boxes.x1 - boxes.de + (boxes.x2 - boxes.x1) / 2)[1::2]
+            text_y[1::2] = (boxes.y1 - boxes.de - 20)[1::2]
+
+        for i, index in enumerate(box_layer_index):
+            draw_layer_shapes.text((text_x[i], text_y[i]), layer_shape_txt[index], font=font_shapes, fill=font_color,
                                    direction='ltr', anchor='mm', align='center')
 
     # Create layer color legend
@@ -346,35 +333,45 @@ def layered_view(model, to_file: str = None, min_z: int = 20, min_xy: int = 20,
 
         patches = list()
 
-        for layer_type in layer_types:
-            label = layer_type.__name__
-            text_size = font.getsize(label)
-            label_patch_size = (2 * cube_size + de + spacing + text_size[0], cube_size + de)
-            # this only works if cube_size is bigger than text height
+        labels = [layer_type.__name__ for layer_type in layer_types]
+        text_widths = [font.getsize(label)[0] for label in labels]
+        label_patch_sizes = [(2 * cube_size + de + spacing + text_width, cube_size + de) for text_width in text_widths]
+        # this only works if cube_size is bigger than text height
 
-            img_box = Image.new('RGBA', label_patch_size, background_fill)
-            img_text = Image.new('RGBA', label_patch_size, (0, 0, 0, 0))
-            draw_box = aggdraw.Draw(img_box)
-            draw_text = ImageDraw.Draw(img_text)
+        # All patches are drawn on one canvas, one row per layer type. Rows are separated by cube_size so that
+        # anti-aliased edges do not bleed into the neighbouring patch.
+        row_height = cube_size + de + cube_size
+        canvas_size = (max([w for w, _ in label_patch_sizes], default=0), max(len(layer_types) * row_height, 1))
+        img_box = Image.new('RGBA', canvas_size, background_fill)
+        draw_box = aggdraw.Draw(img_box)
+
+        legend_boxes = list()
+        for row, layer_type in enumerate(layer_types):
+            row_y = row * row_height
 
             box = Box()
             box.x1 = cube_size
             box.x2 = box.x1 + cube_size
-            box.y1 = de
+            box.y1 = row_y + de
             box.y2 = box.y1 + cube_size
             box.de = de
             box.shade = shade_step
             box.fill = color_map.get(layer_type, {}).get('fill', "#000000")
             box.outline = color_map.get(layer_type, {}).get('outline', "#000000")
             box.draw(draw_box, draw_reversed)
+            legend_boxes.append(box)
+
+        draw_box.flush()
+
+        # Text is drawn straight onto the flushed box image
+        draw_text = ImageDraw.Draw(img_box)
+        for row, (box, label, label_patch_size) in enumerate(zip(legend_boxes, labels, label_patch_sizes)):
+            row_y = row * row_height
 
             text_x = box.x2 + box.de + spacing
             text_y = (label_patch_size[1] - text_height) / 2  # 2D center; use text_height and not the current label!
-            draw_text.text((text_x, text_y), label, font=font, fill=font_color)
-
-            draw_box.flush()
-            img_box.paste(img_text, mask=img_text)
-            patches.append(img_box)
+            draw_text.text((text_x, row_y + text_y), label, font=font, fill=font_color)
+            patches.append(img_box.crop((0, row_y, label_patch_size[0], row_y + label_patch_size[1])))
 
         legend_image = linear_layout(patches, max_width=img.width, max_height=img.height, padding=padding,
                                      spacing=spacing,
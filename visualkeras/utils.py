@@ -1,4 +1,6 @@
 from typing import Any
+from functools import lru_cache
+import numpy as np
 from PIL import ImageColor, ImageDraw, Image
 import aggdraw
 
@@ -28,8 +30,8 @@ class RectShape:
         self._outline = get_rgba_tuple(v)
 
     def _get_pen_brush(self):
-        pen = aggdraw.Pen(self._outline)
-        brush = aggdraw.Brush(self._fill)
+        pen = get_pen(self._outline)
+        brush = get_brush(self._fill)
         return pen, brush
 
 
@@ -41,8 +43,8 @@ class Box(RectShape):
         pen, brush = self._get_pen_brush()
 
         if hasattr(self, 'de') and self.de > 0:
-            brush_s1 = aggdraw.Brush(fade_color(self.fill, self.shade))
-            brush_s2 = aggdraw.Brush(fade_color(self.fill, 2 * self.shade))
+            brush_s1 = get_brush(fade_color(self.fill, self.shade))
+            brush_s2 = get_brush(fade_color(self.fill, 2 * self.shade))
 
             if draw_reversed:
                 draw.line([self.x2 - self.de, self.y1 - self.de, self.x2 - self.de, self.y2 - self.de], pen)
@@ -80,6 +82,38 @@ class Box(RectShape):
         draw.rectangle([self.x1, self.y1, self.x2, self.y2], pen, brush)
 
 
+class BoxArray:
+    """
+    Structure of arrays holding the geometry of many boxes. Coordinates are stored as one numpy array per field, so
+    they can be shifted or reduced for all boxes at once. Individual Box objects are only created when indexing.
+    """
+
+    def __init__(self, x1, x2, y1, y2, de, fill: list, outline: list, shade: int):
+        self.x1 = np.array(x1, dtype=float)
+        self.x2 = np.array(x2, dtype=float)
+        self.y1 = np.array(y1, dtype=float)
+        self.y2 = np.array(y2, dtype=float)
+        self.de = np.array(de, dtype=float)
+        self.fill = list(fill)
+        self.outline = list(outline)
+        self.shade = shade
+
+    def __len__(self):
+        return len(self.de)
+
+    def __getitem__(self, i: int) -> Box:
+        box = Box()
+        box.x1 = float(self.x1[i])
+        box.x2 = float(self.x2[i])
+        box.y1 = float(self.y1[i])
+        box.y2 = float(self.y2[i])
+        box.de = float(self.de[i])
+        box.fill = self.fill[i]
+        box.outline = self.outline[i]
+        box.shade = self.shade
+        return box
+
+
 class Circle(RectShape):
 
     def draw(self, draw: ImageDraw):
@@ -121,21 +155,50 @@ def fade_color(color: tuple, fade_amount: int) -> tuple:
 def get_rgba_tuple(color: Any) -> tuple:
     """
 
-    :param color:
+    :param color: Color as str, int or (R,G,B) / (R,G,B,A) tuple or list.
     :return: (R, G, B, A) tuple
     """
-    if isinstance(color, tuple):
-        rgba = color
+    if isinstance(color, (tuple, list)):
+        rgba = tuple(color)
     elif isinstance(color, int):
         rgba = (color >> 16 & 0xff, color >> 8 & 0xff, color & 0xff, color >> 24 & 0xff)
     else:
-        rgba = ImageColor.getrgb(color)
+        rgba = _parse_color_str(color)
 
     if len(rgba) == 3:
         rgba = (rgba[0], rgba[1], rgba[2], 255)
     return rgba
 
 
+@lru_cache(maxsize=128)
+def _parse_color_str(color: str) -> tuple:
+    return ImageColor.getrgb(color)
+
+
+@lru_cache(maxsize=128)
+def get_pen(color: tuple) -> aggdraw.Pen:
+    """
+    Returns a shared aggdraw pen for the given color. Pens are cached, so repeated calls with the same color will not
+    allocate new pens.
+
+    :param color: (R, G, B, A) tuple
+    :return: aggdraw pen
+    """
+    return aggdraw.Pen(color)
+
+
+@lru_cache(maxsize=128)
+def get_brush(color: tuple) -> aggdraw.Brush:
+    """
+    Returns a shared aggdraw brush for the given color. Brushes are cached, so repeated calls with the same color will
+    not allocate new brushes.
+
+    :param color: (R, G, B, A) tuple
+    :return: aggdraw brush
+    """
+    return aggdraw.Brush(color)
+
+
 def get_keys_by_value(d, v):
     for key in d.keys():  # reverse search the dict for the value
         if d[key] == v:
@@ -159,6 +222,43 @@ def self_multiply(tensor_tuple: tuple):
     return s
 
 
+# Released images, oldest first, reused by acquire_image
+_IMAGE_POOL = list()
+_IMAGE_POOL_SIZE = 8
+
+
+def acquire_image(size: tuple, background_fill: Any = 'white') -> Image:
+    """
+    Returns an RGBA image of the given size filled with the background color. Images previously handed back with
+    release_image are cleared and reused instead of allocating a new image.
+
+    :param size: (width, height) of the image
+    :param background_fill: Color for the image background. Can be str or (R,G,B,A).
+    :return: image
+    """
+    size = tuple(size)
+    for i in reversed(range(len(_IMAGE_POOL))):
+        if _IMAGE_POOL[i].size == size:
+            img = _IMAGE_POOL.pop(i)
+            img.paste(background_fill, (0, 0) + size)
+            return img
+    return Image.new('RGBA', size, background_fill)
+
+
+def release_image(img: Image):
+    """
+    Hands an image back to the pool of acquire_image, so it can be reused by later renders (e.g. the return value of
+    layered_view once it has been saved or shown). The image must not be used by the caller afterwards. The pool keeps
+    at most a few images and drops the oldest ones first.
+
+    :param img: RGBA image
+    """
+    if img.mode != 'RGBA' or any(img is pooled for pooled in _IMAGE_POOL):
+        return
+    _IMAGE_POOL.append(img)
+    del _IMAGE_POOL[:-_IMAGE_POOL_SIZE]
+
+
 def vertical_image_concat(im1: Image, im2: Image, background_fill: Any = 'white'):
     """
     Vertical concatenation of two PIL images.